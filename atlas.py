@@ -0,0 +1,139 @@
+import os
+import math
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import pygame
+
+# Tile properties that the floor graph is built from, as bits
+FLOOR = 1
+WALL_EAST = 2
+WALL_SOUTH = 4
+DOOR_EAST = 8
+DOOR_SOUTH = 16
+property_flags = {
+    'floor': FLOOR
+    ,'wall_east': WALL_EAST
+    ,'wall_south': WALL_SOUTH
+    ,'door_east': DOOR_EAST
+    ,'door_south': DOOR_SOUTH
+}
+
+# Threads that composite map surfaces, blits let go of the GIL
+workers = os.cpu_count() or 1
+_pool = None
+
+def pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(workers)
+    return _pool
+
+def image_kind(img):
+    if img.get_flags() & pygame.SRCALPHA:
+        return ('alpha',)
+    return ('key', img.get_colorkey())
+
+class TileAtlas:
+    """ Every tile image of a map packed into one surface, and flat tables,
+    indexed by gid, of what building a level needs to know about each tile
+
+    The tables stand in for asking pytmx about each tile as it is placed.
+    Images that can't share the atlas, because they have a different colorkey
+    or alpha to most of the others, are kept as surfaces of their own. """
+    def __init__(self, tmx):
+        images = tmx.images
+        n = len(images)
+        self.sizes = [None]*n
+        self.offsets = [None]*n
+        self.props = [{} for _ in range(n)]
+        self.flags = [0]*n
+        for gid, img in enumerate(images):
+            if img is None:
+                continue
+            w, h = self.sizes[gid] = img.get_size()
+            # Where the image goes relative to the top corner of its cell
+            self.offsets[gid] = (tmx.tilewidth/2 - w, tmx.tileheight - h)
+            props = tmx.get_tile_properties_by_gid(gid) or {}
+            self.props[gid] = props
+            self.flags[gid] = sum(bit for name, bit in property_flags.items() if props.get(name, False))
+        self.max_width = max((w for w,h in filter(None, self.sizes)), default=0)
+        self.max_height = max((h for w,h in filter(None, self.sizes)), default=0)
+        self.max_size = max(self.max_width, self.max_height)
+        self.pack(images)
+        self.tables = [self.table(self.surfaces)]
+
+    def pack(self, images):
+        kinds = Counter(image_kind(img) for img in images if img is not None)
+        kind = kinds.most_common(1)[0][0] if kinds else ('key', None)
+        packed = [gid for gid, img in enumerate(images) if img is not None and image_kind(img) == kind]
+        # Shelves of tiles, tallest first, in a roughly square surface
+        packed.sort(key=lambda gid: -self.sizes[gid][1])
+        width = max([math.isqrt(sum(w*h for w,h in map(self.sizes.__getitem__, packed)))]
+            + [self.sizes[gid][0] for gid in packed])
+        self.areas = [None]*len(images)
+        x = y = shelf = 0
+        for gid in packed:
+            w, h = self.sizes[gid]
+            if x + w > width:
+                x, y, shelf = 0, y+shelf, 0
+            self.areas[gid] = (0, pygame.Rect(x, y, w, h))
+            x += w
+            shelf = max(shelf, h)
+        size = (max(width, 1), max(y+shelf, 1))
+        sample = images[packed[0]] if packed else None
+        if kind[0] == 'alpha':
+            atlas = pygame.Surface(size, pygame.SRCALPHA, sample)
+            atlas.fill((0,0,0,0))
+            flags = pygame.BLEND_RGBA_MAX
+        else:
+            atlas = pygame.Surface(size, 0, sample) if sample else pygame.Surface(size)
+            if kind[1] is not None:
+                atlas.fill(kind[1])
+                atlas.set_colorkey(kind[1])
+            flags = 0
+        for gid in packed:
+            atlas.blit(images[gid], self.areas[gid][1], special_flags=flags)
+        self.surfaces = [atlas]
+        for gid, img in enumerate(images):
+            if img is not None and self.areas[gid] is None:
+                self.areas[gid] = (len(self.surfaces), img.get_rect())
+                self.surfaces.append(img)
+
+    def table(self, surfaces):
+        """ The surface and the area of it holding each gid, as two lists """
+        return (
+            [None if a is None else surfaces[a[0]] for a in self.areas]
+            ,[None if a is None else a[1] for a in self.areas]
+        )
+
+    def sources(self, copy=0):
+        """ (surfaces, areas) of each gid. SDL can't blit from one surface on two
+        threads at once, so each worker thread is given its own copy """
+        while len(self.tables) <= copy:
+            self.tables.append(self.table([s.copy() for s in self.surfaces]))
+        return self.tables[copy]
+
+    def draw(self, size, tiles, origin=(0,0), copy=0):
+        """ A new surface with each (gid, x, y, depth) in tiles drawn on it, where
+        origin is the position that becomes the surface's top left """
+        images, areas = self.sources(copy)
+        ox, oy = origin
+        surface = pygame.Surface(size)
+        surface.blits([(images[gid], (x-ox, y-oy), areas[gid]) for gid, x, y, depth in tiles], doreturn=False)
+        return surface
+
+    def composite(self, jobs):
+        """ draw for each (size, tiles, origin) in jobs, shared out over the
+        worker threads, returns the surfaces in the same order """
+        n = min(workers, len(jobs))
+        if n <= 1:
+            return [self.draw(*job) for job in jobs]
+        # Copies have to be made here, copying a surface blits from it too
+        for i in range(n):
+            self.sources(i)
+        def run(i):
+            return [self.draw(*job, i) for job in jobs[i::n]]
+        surfaces = [None]*len(jobs)
+        for i, drawn in enumerate(pool().map(run, range(n))):
+            surfaces[i::n] = drawn
+        return surfaces
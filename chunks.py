@@ -0,0 +1,81 @@
+import xml.etree.ElementTree as ET
+from startup import lazy_import
+pytmx = lazy_import('pytmx')
+
+def is_infinite(filename):
+    """ Checks the map element without reading the whole file """
+    for event, node in ET.iterparse(filename, events=('start',)):
+        return node.get('infinite', '0') == '1'
+
+class ChunkedMap:
+    """ A Tiled infinite map whose tile layers are decoded one chunk at a time
+
+    pytmx can't load infinite maps, so it is only given the tilesets and the
+    object layers. The chunks of each tile layer are kept as the undecoded text
+    from the file until something asks for them. Everything here is in grid
+    coordinates, which start at the top left of the top left chunk. """
+    def __init__(self, filename, layer_names):
+        root = ET.parse(filename).getroot()
+        found = {}
+        for parent in list(root.iter()):
+            for layer in parent.findall('layer'):
+                parent.remove(layer)
+                name = layer.get('name')
+                if name not in layer_names:
+                    continue
+                data = layer.find('data')
+                for chunk in data.findall('chunk'):
+                    x, y, w, h = [int(chunk.get(a)) for a in ['x', 'y', 'width', 'height']]
+                    found.setdefault((x,y), {})[name] = (chunk.text, data.get('encoding'), data.get('compression'))
+                    self.chunk_size = (w,h)
+        if not found:
+            raise ValueError(f"{filename} has no tile chunks")
+        ox = min(x for x,y in found)
+        oy = min(y for x,y in found)
+        cw, ch = self.chunk_size
+        self.origin = (ox, oy)
+        self.size = (max(x for x,y in found)+cw-ox, max(y for x,y in found)+ch-oy)
+        self.chunks = {(x-ox, y-oy): layers for (x,y), layers in found.items()}
+
+        from pytmx.util_pygame import pygame_image_loader
+        self.tmx = pytmx.TiledMap(image_loader=pygame_image_loader)
+        self.tmx.filename = filename
+        self.tmx.parse_xml(root)
+        self.resolved = {}
+
+    def chunk_at(self, pos):
+        """ The key of the chunk that would hold pos """
+        x, y = pos
+        cw, ch = self.chunk_size
+        return ((x//cw)*cw, (y//ch)*ch)
+
+    def resolve_gid(self, raw):
+        """ Turns a gid from the file into one pytmx knows about, 0 for tiles
+        without an image """
+        gid = self.resolved.get(raw)
+        if gid is not None:
+            return gid
+        gid = 0
+        if raw != 0:
+            tiled_gid, flags = pytmx.pytmx.decode_gid(raw)
+            key = self.tmx.imagemap.get((tiled_gid, flags))
+            if key is None:
+                # Flipped tiles only get their own image if pytmx saw them while
+                # loading, which it never does here, so fall back to the plain tile
+                key = self.tmx.imagemap.get((tiled_gid, pytmx.pytmx.TileFlags(0, 0, 0)), (0,))
+            if key[0] and self.tmx.get_tile_image_by_gid(key[0]) is not None:
+                gid = key[0]
+        self.resolved[raw] = gid
+        return gid
+
+    def decode(self, key):
+        """ The tiles of one chunk, as {layer name: {(x,y): gid}} """
+        cx, cy = key
+        cw, ch = self.chunk_size
+        tiles = {}
+        cells = [(cx + x, cy + y) for y in range(ch) for x in range(cw)]
+        for name, (text, encoding, compression) in self.chunks[key].items():
+            gids = pytmx.pytmx.unpack_gids(text.strip(), encoding, compression)
+            resolved = {raw: self.resolve_gid(raw) for raw in set(gids)}
+            tiles[name] = {pos: gid for pos, raw in zip(cells, gids) if (gid := resolved[raw])}
+        return tiles
@@ -1,18 +1,51 @@
 #!/usr/bin/env python3
+from startup import Timings, lazy_import, sys_font
+timings = Timings()
 import math
 import sys
 import pygame
 import threading
 import time
 from enum import Enum
-import pytmx
-from pytmx.util_pygame import load_pygame as load_tmx
 import traceback
-import networkx as nx
+# These two are slow to import and aren't needed until a level loads, which
+# happens after the window is up
+pytmx = lazy_import('pytmx')
+nx = lazy_import('networkx')
+from pathfinding import RoomPaths
+from hotreload import MapWatcher, diff_tiles, object_signature
+from chunks import ChunkedMap, is_infinite
+from drawlist import DrawList
+from atlas import TileAtlas, FLOOR, WALL_EAST, WALL_SOUTH, DOOR_EAST, DOOR_SOUTH
+timings.add('imports', timings.start)
 
 target_fps = 30
+# Most chunks of an infinite map to composite in one frame
+chunks_per_frame = 4
+# Most chunks of an infinite map to decode before the first frame, looking for
+# the shortest routes between the guard's points
+patrol_chunks = 64
+
+levels = [
+    'Tiled/Map1.tmx'
+    ,'Tiled/Map2.tmx'
+    ,'Tiled/Map3.tmx'
+    ,'Tiled/Map4.tmx'
+    ,'Tiled/Map5.tmx'
+]
+
+# Tile layers in the order they are drawn, and which surface they go on
+floor_layers = ['Floor']
+wall_layers = ['Walls', 'Doors']
+overlay_layers = ['GuardEntrance', 'GuardExit']
+tile_layers = floor_layers + wall_layers + overlay_layers
 
 RENDER = pygame.event.custom_type()
+MAP_CHANGED = pygame.event.custom_type()
+
+def load_tmx(name):
+    from pytmx.util_pygame import load_pygame
+    return load_pygame(name)
 
 def surface_geom(w, h, tw, th):
     return (
@@ -38,6 +71,23 @@ def surface_to_grid(x, y, w, h, tw, th):
         ,math.floor(sy)
     )
 
+def read_tiles(tmx):
+    """ Every tile with an image in each tile layer, as {layer name: {(x,y): gid}} """
+    tiles = {}
+    images = tmx.images
+    for name in tile_layers:
+        try:
+            layer = tmx.get_layer_by_name(name)
+        except ValueError:
+            continue
+        if not isinstance(layer, pytmx.pytmx.TiledTileLayer):
+            continue
+        tiles[name] = {
+            (x,y): gid for x, y, gid in layer.iter_data()
+            if images[gid] is not None
+        }
+    return tiles
+
 def add(c1,c2):
     ((x1,y1),(x2,y2)) = (c1,c2)
     return (
@@ -120,11 +170,25 @@ class Animation:
                 self.frame_width, self.frame_height
             )) for f in range(start_frame, end_frame+1)
         ]
+        self.scaled_size = None
+        self.scaled_frames = {}
 
     def get_frame(self, n):
         i = (n % self.n_frames)
         return self.frames[i]
 
+    def get_scaled_frame(self, n, size):
+        """ get_frame scaled to size, kept until a different size is asked for """
+        if size != self.scaled_size:
+            self.scaled_size = size
+            self.scaled_frames = {}
+        i = (n % self.n_frames)
+        frame = self.scaled_frames.get(i)
+        if frame is None:
+            frame = pygame.transform.scale(self.frames[i], size)
+            self.scaled_frames[i] = frame
+        return frame
+
 class Character:
     def __init__(self, marker, tile_unit):
         self.anims = {}
@@ -154,22 +218,19 @@ class Character:
     def clear_selection(self):
         self.selected = False
 
-    def draw(self, surf, pos, scale):
+    def sprites(self, pos, scale):
+        """ The (image, position) pairs to blit to draw this character at pos """
         if self.cur_anim is None:
-            return
+            return []
         anim = self.anims[self.cur_anim]
         f = self.cur_frame
-        img = anim.get_frame(f)
         lpos = add(pos, mul(vmul(self.screen_heading, mul(self.tile_unit, (self.step_progress/self.frames_per_tile)/2)), scale))
 
-        newsize = mul(self.size, scale)
-        scaled_char = pygame.transform.scale(img, newsize)
-
-        surf.blit(scaled_char, lpos)
+        sprites = [(anim.get_scaled_frame(f, mul(self.size, scale)), lpos)]
         if self.selected:
-            newsize = mul(self.marker.size, scale)
-            scaled_marker = pygame.transform.scale(self.marker.get_frame(f), newsize)
-            surf.blit(scaled_marker, add(lpos, mul((16, -4), scale)))
+            scaled_marker = self.marker.get_scaled_frame(f, mul(self.marker.size, scale))
+            sprites.append((scaled_marker, add(lpos, mul((16, -4), scale))))
+        return sprites
 
     def next_frame(self):
         self.cur_frame += 1
@@ -233,27 +294,33 @@ class Character:
         else:
             self.idle()
 
+class Chunk:
+    """ The surfaces of one loaded chunk of an infinite map """
+    def __init__(self, key, rect):
+        self.key = key
+        self.rect = rect
+        self.floor = None
+        self.overlay = None
+        self.parts = {}
+        # Left edge of each part on the map surface, parts are only as wide as their tiles
+        self.part_x = {}
+
 class Game:
-    def __init__(self):
-        self.win = pygame.display.set_mode((1000,700), pygame.RESIZABLE)
+    def __init__(self, background_load=False, show_timings=False):
+        with timings.phase('window'):
+            self.win = pygame.display.set_mode((1000,700), pygame.RESIZABLE)
         self.stop_event = threading.Event()
         self.can_render = threading.Event()
         self.can_render.set()
         self.last_time = time.time()
-        self.font = pygame.font.SysFont("monospace", 18)
-        self.big_font = pygame.font.SysFont("sans", 70)
-        self.button_font = pygame.font.SysFont("sans", 40)
-        self.tip_font = pygame.font.SysFont("sans", 18)
+        with timings.phase('fonts'):
+            self.font = sys_font("monospace", 18)
+            self.big_font = sys_font("sans", 70)
+            self.button_font = sys_font("sans", 40)
+            self.tip_font = sys_font("sans", 18)
         self.guard_points = []
-        self.levels = [
-            'Tiled/Map1.tmx'
-            ,'Tiled/Map2.tmx'
-            ,'Tiled/Map3.tmx'
-            ,'Tiled/Map4.tmx'
-            ,'Tiled/Map5.tmx'
-        ]
+        self.levels = levels
         self.cur_level = 0
-        self.load_next_level()
         self.cursor = None
         self.selection = None
         self.path_plan = None
@@ -262,6 +329,8 @@ class Game:
         self.game_is_over = False
         self.panning = False
         self.hover_occupied = None
+        self.hover_pending = False
+        self.last_mouse_pos = (0,0)
 
         self.scale = 1
         self.scroll = 10
@@ -270,13 +339,31 @@ class Game:
 
         self.marker = Animation('Pointer.png', (16,16), 0, 15)
 
-        self.restart_level()
+        self.show_timings = show_timings
+        self.loaded = threading.Event()
+        self.load_error = None
+        if background_load:
+            threading.Thread(target=self.load_first_level, daemon=True).start()
+        else:
+            self.load_first_level()
+            if self.load_error is not None:
+                raise self.load_error
+
+    def load_first_level(self):
+        try:
+            with timings.phase('level load'):
+                self.load_next_level()
+                self.restart_level()
+        except Exception as e:
+            self.load_error = e
+        self.loaded.set()
 
     def load_next_level(self):
         self.load_map(self.levels[self.cur_level])
         self.cur_level += 1
 
     def restart_level(self):
+        self.hover_key = None
         self.all_player_chars = []
         for c in self.char_points:
             player = self.load_character('Character1.png')
@@ -354,84 +441,443 @@ class Game:
         return surface_to_grid(x,y,self.w,self.h,self.tw,self.th)
 
     def coords(self, pos, size=None):
+        return add(self.offset, self.map_coords(pos, size))
+
+    def map_coords(self, pos, size=None):
+        """ coords, relative to the map's offset on screen """
         if size is None:
             size = (self.tw/2, self.th)
         delta = sub((self.tw/2, self.th), size)
-        return add(self.offset, mul(add(delta, self.grid_to_surface(*pos)),self.scale))
+        return mul(add(delta, self.grid_to_surface(*pos)),self.scale)
 
     def load_map(self, name):
+        self.map_name = name
+        if is_infinite(name):
+            self.load_chunked_map(name)
+            return
+        self.chunked = None
+        self.origin = (0,0)
         self.map = load_tmx(name)
+        self.atlas = TileAtlas(self.map)
         self.w = self.map.width
         self.h = self.map.height
         self.tw = self.map.tilewidth
         self.th = self.map.tileheight
         self.sw, self.sh = surface_geom(self.w, self.h, self.tw, self.th)
-        self.map_surface = pygame.Surface((self.sw,self.sh))
-        self.overlay_surface = pygame.Surface((self.sw,self.sh))
-        self.overlay_surface.convert_alpha()
+        self.tiles = read_tiles(self.map)
+        floor = []
+        overlay = []
+        parts = {}
+        for layer in tile_layers:
+            placed = self.place_tiles(self.tiles.get(layer, {}).items())
+            if layer in floor_layers:
+                floor.extend(placed)
+            elif layer in overlay_layers:
+                overlay.extend(placed)
+            else:
+                for tile in placed:
+                    parts.setdefault(tile[3], []).append(tile)
+        depths = sorted(parts)
+        size = (self.sw, self.sh)
+        part_size = (self.sw, self.th*2)
+        surfaces = self.atlas.composite([(size, floor, (0,0)), (size, overlay, (0,0))]
+            + [(part_size, parts[d], (0, self.part_top(d))) for d in depths])
+        self.map_surface, self.overlay_surface = surfaces[:2]
         self.overlay_surface.set_alpha(255)
-        self.map_parts = {}
+        self.map_parts = dict(zip(depths, surfaces[2:]))
+        self.build_graph()
+        self.offset = (100,100)
+        self.load_points()
+
+    def build_graph(self):
+        """ The floor graph of every tile, from nothing """
+        self.room = nx.Graph()
+        self.doors = []
+        self.paths = None
+        self.tile_doors = {}
+        self.update_graph(sorted({p for tiles in self.tiles.values() for p in tiles}, key=lambda p: (p[1],p[0])))
+
+    def load_chunked_map(self, name):
+        """ Infinite maps are only read a chunk at a time, as they come into
+        view, see stream_chunks """
+        self.chunked = ChunkedMap(name, tile_layers)
+        self.map = self.chunked.tmx
+        self.atlas = TileAtlas(self.map)
+        self.origin = self.chunked.origin
+        self.w, self.h = self.chunked.size
+        self.tw = self.map.tilewidth
+        self.th = self.map.tileheight
+        self.sw, self.sh = surface_geom(self.w, self.h, self.tw, self.th)
+        self.tiles = {layer: {} for layer in tile_layers}
+        self.decoded_chunks = set()
+        self.loaded_chunks = {}
+        self.room = nx.Graph()
         self.doors = []
-        g = nx.Graph()
-        layer_id = lambda layer: next(i for i, l in enumerate(self.map.layers) if l==layer)
+        self.paths = None
+        self.tile_doors = {}
+        self.offset = (100,100)
+        self.load_points()
+        # Everything the level's points touch has to be walkable from the
+        # start, so the guard can plan its patrol
+        points = [p for room in self.rooms for p in room] + self.guard_points + self.char_points
+        points += [p for p in [self.guard_start, self.guard_end] if p is not None]
+        if points:
+            cw, ch = self.chunked.chunk_size
+            x0, y0 = self.chunked.chunk_at([min(c) for c in zip(*points)])
+            x1, y1 = self.chunked.chunk_at([max(c) for c in zip(*points)])
+            box = (x0, y0, x1+cw, y1+ch)
+            self.decode_box(box)
+            # The patrol can leave the box, keep going until it can't have, or
+            # until there's been enough looking and the best route so far will do
+            while not self.patrol_known(box):
+                if len(self.decoded_chunks) >= patrol_chunks:
+                    self.check_patrol(name)
+                    break
+                x0, y0, x1, y1 = box
+                box = (max(x0-cw, 0), max(y0-ch, 0), min(x1+cw, self.w), min(y1+ch, self.h))
+                self.decode_box(box)
+
+    def decode_box(self, box):
+        x0, y0, x1, y1 = box
+        self.decode_chunks([
+            key for key in self.chunked.chunks
+            if x0 <= key[0] < x1 and y0 <= key[1] < y1
+        ])
+
+    def patrol_known(self, box):
+        """ Whether the shortest routes between the guard's points are already
+        in the floor graph, which has only the chunks inside box decoded. Any
+        route through undecoded chunks has to walk out of the box and back """
+        x0, y0, x1, y1 = box
+        def way_out(p):
+            x, y = p
+            steps = [x-x0+1 if x0 > 0 else math.inf
+                , x1-x if x1 < self.w else math.inf
+                , y-y0+1 if y0 > 0 else math.inf
+                , y1-y if y1 < self.h else math.inf]
+            return min(steps)
+        for a, b in zip(self.guard_points, self.guard_points[1:]):
+            try:
+                length = nx.shortest_path_length(self.room, a, b)
+            except (nx.NetworkXNoPath, nx.NodeNotFound):
+                length = math.inf
+            if length > way_out(a) + way_out(b):
+                return False
+        return True
+
+    def check_patrol(self, name):
+        for a, b in zip(self.guard_points, self.guard_points[1:]):
+            if a not in self.room or b not in self.room or not nx.has_path(self.room, a, b):
+                raise ValueError(f"{name}: no path between guard points {a} and {b} within {patrol_chunks} chunks")
+
+    def decode_chunks(self, keys):
+        """ Adds the tiles of the given chunks to the floor graph """
+        keys = [k for k in keys if k not in self.decoded_chunks]
+        changed = []
+        for key in keys:
+            for layer, tiles in self.chunked.decode(key).items():
+                self.tiles[layer].update(tiles)
+                changed.extend(tiles)
+            self.decoded_chunks.add(key)
+        if changed:
+            self.update_graph(sorted(set(changed), key=lambda p: (p[1],p[0])))
+
+    def chunk_rect(self, key):
+        """ Area of the map surface that the tiles of a chunk can draw on """
+        cx, cy = key
+        cw, ch = self.chunked.chunk_size
+        # Tile images hang left and up from the bottom right of their cells
+        left = self.grid_to_surface(cx, cy+ch-1)[0] + self.tw/2 - self.atlas.max_width
+        right = self.grid_to_surface(cx+cw-1, cy)[0] + self.tw/2
+        top = self.grid_to_surface(cx, cy)[1] + self.th - self.atlas.max_height
+        bottom = self.grid_to_surface(cx+cw-1, cy+ch-1)[1] + self.th
+        return pygame.Rect(math.floor(left), math.floor(top), math.ceil(right-left)+1, math.ceil(bottom-top)+1)
+
+    def load_chunks(self, keys):
+        """ Composites the given chunks, together, on the atlas's worker threads """
+        self.decode_chunks(keys)
+        chunks = []
+        jobs = []
+        for key in keys:
+            rect = self.chunk_rect(key)
+            chunk = Chunk(key, rect)
+            floor = []
+            overlay = []
+            parts = {}
+            cx, cy = key
+            cw, ch = self.chunked.chunk_size
+            cells = [(x, y) for y in range(cy, cy+ch) for x in range(cx, cx+cw)]
+            for layer in tile_layers:
+                tiles = self.tiles.get(layer)
+                if not tiles:
+                    continue
+                placed = self.place_tiles([(p, tiles[p]) for p in cells if p in tiles])
+                if layer in floor_layers:
+                    floor.extend(placed)
+                elif layer in overlay_layers:
+                    overlay.extend(placed)
+                else:
+                    for tile in placed:
+                        parts.setdefault(tile[3], []).append(tile)
+            # Most chunks have nothing on the overlay, and each part only
+            # covers a short diagonal of the chunk, so leave out the empty space
+            if floor:
+                jobs.append((rect.size, floor, rect.topleft))
+            if overlay:
+                jobs.append((rect.size, overlay, rect.topleft))
+            sizes = self.atlas.sizes
+            for depth, tiles in parts.items():
+                x0 = min(px for gid, px, py, d in tiles)
+                x1 = max(px + sizes[gid][0] for gid, px, py, d in tiles)
+                chunk.part_x[depth] = x0
+                jobs.append(((x1-x0, self.th*2), tiles, (x0, self.part_top(depth))))
+            chunks.append((chunk, bool(floor), bool(overlay)))
+        surfaces = iter(self.atlas.composite(jobs))
+        for chunk, has_floor, has_overlay in chunks:
+            chunk.floor = next(surfaces) if has_floor else None
+            chunk.overlay = next(surfaces) if has_overlay else None
+            chunk.parts = {d: next(surfaces) for d in chunk.part_x}
+            for surface in [chunk.floor, chunk.overlay, *chunk.parts.values()]:
+                if surface is not None:
+                    surface.set_colorkey((0, 0, 0))
+            self.loaded_chunks[chunk.key] = chunk
+            self.scale_chunk(chunk)
+
+    def scale_chunk(self, chunk):
+        s = self.scale
+        def scaled(surface):
+            if surface is None or s == 1:
+                return surface
+            return pygame.transform.scale(surface, mul(surface.get_size(), s))
+        chunk.scaled_floor = scaled(chunk.floor)
+        chunk.scaled_overlay = scaled(chunk.overlay)
+        chunk.scaled_parts = {depth: scaled(part) for depth, part in chunk.parts.items()}
+        cx, cy = chunk.key
+        for depth, part in chunk.scaled_parts.items():
+            self.draw_list.set(('chunk', chunk.key, depth), (depth, 0, (cy, cx)), part, (chunk.part_x[depth]*s, self.strip_top(depth)))
+
+    def unload_chunk(self, key):
+        chunk = self.loaded_chunks.pop(key)
+        for depth in chunk.parts:
+            self.draw_list.remove(('chunk', key, depth))
+
+    def chunks_in_view(self, margin):
+        """ Chunks on screen, plus a margin of chunks around them """
+        ww, wh = self.win.get_size()
+        corners = [self.to_cursor_pos(c) for c in [(0,0), (ww,0), (0,wh), (ww,wh)]]
+        cw, ch = self.chunked.chunk_size
+        x0, y0 = self.chunked.chunk_at((min(x for x,y in corners), min(y for x,y in corners)))
+        x1, y1 = self.chunked.chunk_at((max(x for x,y in corners), max(y for x,y in corners)))
+        return {
+            (x,y)
+            for x in range(x0-margin*cw, x1+(margin+1)*cw, cw)
+            for y in range(y0-margin*ch, y1+(margin+1)*ch, ch)
+            if (x,y) in self.chunked.chunks
+        }
+
+    def chunks_near_chars(self, margin):
+        cw, ch = self.chunked.chunk_size
+        near = set()
+        for c in self.all_chars:
+            x, y = self.chunked.chunk_at(c.pos)
+            for dx in range(-margin, margin+1):
+                for dy in range(-margin, margin+1):
+                    key = (x+dx*cw, y+dy*ch)
+                    if key in self.chunked.chunks:
+                        near.add(key)
+        return near
+
+    def stream_chunks(self):
+        """ Loads chunks as they come near the view or a character, and drops
+        the ones that have gone well out of the way """
+        if self.chunked is None:
+            return
+        wanted = self.chunks_in_view(1) | self.chunks_near_chars(0)
+        keep = self.chunks_in_view(2) | self.chunks_near_chars(1)
+        for key in list(self.loaded_chunks):
+            if key not in keep:
+                self.unload_chunk(key)
+        missing = [key for key in wanted if key not in self.loaded_chunks]
+        # Spread the work out over a few frames, nearest the middle of the view first
+        ww, wh = self.win.get_size()
+        cx, cy = self.to_cursor_pos((ww/2, wh/2))
+        missing.sort(key=lambda k: abs(k[0]-cx)+abs(k[1]-cy))
+        self.load_chunks(missing[:chunks_per_frame])
+
+    def tile_pos(self, x, y, gid):
+        """ Top left of a tile's image on the map surface """
+        sx, sy = self.grid_to_surface(x, y)
+        dx, dy = self.atlas.offsets[gid]
+        return (int(sx+dx), int(sy+dy))
+
+    def place_tiles(self, tiles):
+        """ tile_pos for each ((x,y), gid) in tiles at once, as a list of
+        (gid, x, y, depth) with the position of each tile's image """
+        tw, th = self.tw, self.th
+        left = tw * (self.h-1)
+        offsets = self.atlas.offsets
+        # The same sums as grid_to_surface
+        return [
+            (gid, int((left + (x-y)*tw) / 2 + offsets[gid][0]), int(((x+y)*th) / 2 + offsets[gid][1]), x+y+1)
+            for (x,y), gid in tiles
+        ]
+
+    def tile_rect(self, x, y, gid):
+        return pygame.Rect(self.tile_pos(x, y, gid), self.atlas.sizes[gid])
+
+    def tile_props(self, layer, pos):
+        gid = self.tiles.get(layer, {}).get(pos)
+        if gid is None:
+            return {}
+        return self.atlas.props[gid]
+
+    def tile_flags(self, positions):
+        """ The property flags of every tile at each position, and a bit per
+        tile layer that has floor there, as floor only joins floor on the same
+        layer. Empty positions are left out """
+        flags = {}
+        floor = {}
+        table = self.atlas.flags
+        for i, tiles in enumerate(self.tiles.values()):
+            bit = 1 << i
+            for p in positions:
+                gid = tiles.get(p)
+                if gid is not None:
+                    f = table[gid]
+                    flags[p] = flags.get(p, 0) | f
+                    if f & FLOOR:
+                        floor[p] = floor.get(p, 0) | bit
+        return flags, floor
+
+    def part_top(self, depth):
+        """ Where the strip of wall and door tiles at depth starts on the map surface """
+        return int(-self.th+((depth-1)*(self.th/2)))
+
+    def draw_map_part(self, depth):
+        """ (Re)draws the strip of wall and door tiles at the given depth """
+        self.map_parts.pop(depth, None)
+        top = self.part_top(depth)
+        blits = []
+        for layer in wall_layers:
+            tiles = self.tiles.get(layer, {})
+            for y in range(max(0, depth-self.w), min(self.h, depth)):
+                x = depth-1-y
+                gid = tiles.get((x,y))
+                if gid is not None:
+                    px, py = self.tile_pos(x, y, gid)
+                    blits.append((gid, px, py, depth))
+        if blits:
+            self.map_parts[depth] = self.atlas.draw((self.sw, self.th*2), blits, (0, top))
+
+    def redraw_region(self, surface, layers, rect):
+        """ Repaints everything from the given layers that overlaps rect """
+        # Work out which grid cells could have an image reaching into rect
+        corners = [self.surface_to_grid(*c) for c in [rect.topleft, rect.topright, rect.bottomleft, rect.bottomright]]
+        margin = math.ceil(2*self.atlas.max_size/self.th)+1
+        x0 = max(0, min(x for x,y in corners)-margin)
+        x1 = min(self.w, max(x for x,y in corners)+margin+1)
+        y0 = max(0, min(y for x,y in corners)-margin)
+        y1 = min(self.h, max(y for x,y in corners)+margin+1)
+        images, areas = self.atlas.sources()
+        blits = []
+        for layer in layers:
+            tiles = self.tiles.get(layer, {})
+            for y in range(y0, y1):
+                for x in range(x0, x1):
+                    gid = tiles.get((x,y))
+                    if gid is None:
+                        continue
+                    r = self.tile_rect(x, y, gid)
+                    if r.colliderect(rect):
+                        blits.append((images[gid], r, areas[gid]))
+        surface.set_clip(rect)
+        surface.fill((0,0,0), rect)
+        surface.blits(blits, doreturn=False)
+        surface.set_clip(None)
+
+    def update_graph(self, changed):
+        """ Recomputes the floor graph and doors around the changed tiles,
+        returns whether anything about them changed """
+        g = self.room
+        flags, floor = self.tile_flags({
+            n for x, y in changed for n in [(x, y), (x-1, y), (x+1, y), (x, y-1), (x, y+1)]
+        })
+        layer_bits = [1 << i for i in range(len(self.tiles))]
+
+        # networkx breaks ties between equally short paths by the order nodes
+        # and edges went into the graph, so they go in the order a full build
+        # has always used: layer by layer, row by row, each floor tile joining
+        # its west and north neighbours on the same layer. Each edge is kept as
+        # (tile, west or north neighbour).
+        added = []
+        edges = []
+        seen = set()
+        for bit in layer_bits:
+            for p in changed:
+                if not floor.get(p, 0) & bit:
+                    continue
+                if p not in g and p not in seen:
+                    added.append(p)
+                    seen.add(p)
+                x, y = p
+                for edge in [(p, (x-1, y)), (p, (x, y-1))]:
+                    if floor.get(edge[1], 0) & bit and edge not in seen:
+                        edges.append(edge)
+                        seen.add(edge)
+        # Then every other edge the changed tiles touch, which might need removing
+        for p in changed:
+            x, y = p
+            for edge in [(p, (x-1, y)), (p, (x, y-1)), ((x+1, y), p), ((x, y+1), p)]:
+                if edge not in seen:
+                    edges.append(edge)
+                    seen.add(edge)
+        removed = [p for p in changed if p not in floor and p in g]
+        g.add_nodes_from(added)
+        g.remove_nodes_from(removed)
+        doors_changed = False
+        for p in changed:
+            x, y = p
+            f = flags.get(p, 0)
+            doors = []
+            if f & DOOR_EAST:
+                doors.extend([(p, (x+1, y)), ((x+1, y), p)])
+            if f & DOOR_SOUTH:
+                doors.extend([(p, (x, y+1)), ((x, y+1), p)])
+            if doors != self.tile_doors.get(p, []):
+                doors_changed = True
+            if doors:
+                self.tile_doors[p] = doors
+            else:
+                self.tile_doors.pop(p, None)
+
+        new_edges = []
+        old_edges = []
+        for b, a in edges:
+            wall = WALL_EAST if a[1] == b[1] else WALL_SOUTH
+            if floor.get(a, 0) & floor.get(b, 0) and not flags[a] & wall:
+                if not g.has_edge(a, b):
+                    new_edges.append((a, b))
+            elif g.has_edge(a, b):
+                old_edges.append((a, b))
+        g.add_edges_from(new_edges)
+        g.remove_edges_from(old_edges)
+        if doors_changed or added or removed or new_edges or old_edges:
+            self.doors = [d for doors in self.tile_doors.values() for d in doors]
+            if self.paths is not None:
+                self.paths.update(self.doors, changed)
+            return True
+        return False
+
+    def point_to_grid(self, x, y):
+        ox, oy = self.origin
+        return (math.floor(x/self.th)-ox, math.floor(y/self.th)-oy)
+
+    def load_points(self):
         def layer_by_name(name):
             try:
                 return self.map.get_layer_by_name(name)
             except ValueError:
                 return None
-        for layer,name in [(layer_by_name(name),name) for name in ['Floor', 'Walls', 'Doors', 'GuardEntrance', 'GuardExit']]:
-            if not isinstance(layer, pytmx.pytmx.TiledTileLayer):
-                continue
-            for x, y, img_gid in layer.iter_data():
-                img = self.map.get_tile_image_by_gid(img_gid)
-                if img is None:
-                    continue
-                delta = sub((self.tw/2, self.th), img.get_size())
-                pos = add(self.grid_to_surface(x,y), delta)
-                if name == 'Floor':
-                    self.map_surface.blit(img, pos)
-                elif name.startswith('Guard'):
-                    self.overlay_surface.blit(img, pos)
-                else:
-                    depth = x+y+1
-                    part = self.map_parts.get(depth)
-                    if part is None:
-                        part = pygame.Surface((self.sw, self.th*2))
-                        self.map_parts[depth]=part
-                    part.blit(img, sub(pos, (0,-self.th+((depth-1)*(self.th/2)))))
-                props = self.map.get_tile_properties_by_gid(img_gid)
-                if props and props.get('floor', False):
-                    g.add_node((x,y))
-                    for ox, oy in [(x-1,y),(x,y-1)]:
-                        other = self.map.get_tile_properties(ox, oy, layer_id(layer))
-                        if other and other.get('floor',False):
-                            g.add_edge((x,y), (ox,oy))
-                east_wall = props is not None and props.get('wall_east', False)
-                south_wall = props is not None and props.get('wall_south', False)
-                east_door = props is not None and props.get('door_east', False)
-                south_door = props is not None and props.get('door_south', False)
-                to_remove = []
-                if east_wall:
-                    other = add(EAST, (x,y))
-                    to_remove.append(((x,y), other))
-                if south_wall:
-                    other = add(SOUTH, (x,y))
-                    to_remove.append(((x,y), other))
-                if east_door:
-                    other = add(EAST, (x,y))
-                    self.doors.append(((x,y), other))
-                    self.doors.append((other, (x,y)))
-                if south_door:
-                    other = add(SOUTH, (x,y))
-                    self.doors.append(((x,y), other))
-                    self.doors.append((other, (x,y)))
-                for from_, to in to_remove:
-                    try:
-                        g.remove_edge(from_, to)
-                    except nx.NetworkXError:
-                        pass
-        self.offset = (100,100)
-        self.room = g
         points = layer_by_name('Points')
         self.rooms = []
 
@@ -444,30 +890,36 @@ class Game:
             for p in points:
                 props = p.properties
                 if props.get('guard_start', False):
-                    self.guard_start = (math.floor(p.x/self.th),math.floor(p.y/self.th))
+                    self.guard_start = self.point_to_grid(p.x, p.y)
                 if props.get('guard_end', False):
-                    self.guard_end = (math.floor(p.x/self.th),math.floor(p.y/self.th))
+                    self.guard_end = self.point_to_grid(p.x, p.y)
                 passes = props.get('guard_passes')
                 if passes is not None:
                     self.init_guard_passes = passes
                     self.guard_passes = passes
-                    self.guard_pass_point = (math.floor(p.x/self.th),math.floor(p.y/self.th))
+                    self.guard_pass_point = self.point_to_grid(p.x, p.y)
                 if 'index' in props:
                     i = props['index']
-                    guard_points[i] = (math.floor(p.x/self.th),math.floor(p.y/self.th))
+                    guard_points[i] = self.point_to_grid(p.x, p.y)
                 else:
-                    x,y,w,h = [math.floor(a/self.th) for a in [p.x, p.y, p.width, p.height]]
+                    x,y = self.point_to_grid(p.x, p.y)
+                    w,h = [math.floor(a/self.th) for a in [p.width, p.height]]
                     is_goal = props.get('goal', False)
                     start, end = ((x,y),(x+w,y+h))
                     self.rooms.append((start, end))
                     if is_goal:
                         self.goal_room = (start, end)
                 if props.get('character', False):
-                    self.char_points.append((math.floor(p.x/self.th),math.floor(p.y/self.th)))
+                    self.char_points.append(self.point_to_grid(p.x, p.y))
                     
             self.guard_points = [guard_points [k] for k in sorted(guard_points.keys())]
 
 
+    def find_path(self, source, target):
+        if self.paths is None:
+            self.paths = RoomPaths(self.room, self.doors)
+        return self.paths.shortest_path(source, target)
+
     def line(self, from_, to):
         fx, fy = from_
         tx, ty = to
@@ -571,9 +1023,15 @@ class Game:
                                 self.guard.heading = new_heading
                                 self.guard.idle()
                             if self.guard_counter > 30:
-                                next_path, *self.guard_paths = self.guard_paths
-                                self.guard.walk_path([self.guard_exit, *next_path])
-                                self.guard_state = 'walk'
+                                if self.guard_paths:
+                                    next_path, *self.guard_paths = self.guard_paths
+                                    self.guard.walk_path([self.guard_exit, *next_path])
+                                    self.guard_state = 'walk'
+                                else:
+                                    # Nowhere left to patrol, step back out and stay there
+                                    self.guard.walk_path([self.guard_exit])
+                                    self.guard_done = True
+                                    self.guard_state = 'done'
                             self.guard_counter += 1
                 self.check_guard_vision()
 
@@ -609,8 +1067,13 @@ class Game:
         ])
 
     def render(self):
+        self.stream_chunks()
         self.win.fill((0,0,0))
-        self.win.blit(self.scaled_map, self.offset)
+        if self.chunked is None:
+            self.win.blit(self.scaled_map, self.offset)
+        else:
+            chunks = [self.loaded_chunks[k] for k in sorted(self.loaded_chunks, key=lambda k: (k[1],k[0]))]
+            self.win.blits([(c.scaled_floor, add(self.offset, mul(c.rect.topleft, self.scale))) for c in chunks if c.scaled_floor is not None], doreturn=False)
         self.win.convert_alpha()
         self.win.set_alpha(255)
         if self.cursor is not None:
@@ -623,25 +1086,12 @@ class Game:
             self.draw_path(self.path_plan, (0,0,255))
         for p in self.guard_vision:
             self.draw_cursor(p, (255,238,77))
-        chars_for_depth = {}
-        for c in self.all_chars:
-            pos = self.coords(c.pos, c.size)
-            cx,cy=c.pos
-            depth = cx+cy
-            chars = chars_for_depth.get(depth, None)
-            if chars is None:
-                chars = list()
-                chars_for_depth[depth] = chars
-            chars.append(c)
-        for depth in range(0, self.w+self.h):
-            part = self.scaled_map_parts.get(depth)
-            if part is not None:
-                self.win.blit(part, add(self.offset, (0,math.ceil(self.scale * (-self.th+(depth-1) * (self.th/2))))))
-            chars = chars_for_depth.get(depth, [])
-            for char in chars:
-                pos = self.coords(char.pos, char.size)
-                char.draw(self.win, pos, self.scale)
-        self.win.blit(self.scaled_overlay, self.offset)
+        self.update_char_sprites()
+        self.draw_list.draw(self.win, self.offset)
+        if self.chunked is None:
+            self.win.blit(self.scaled_overlay, self.offset)
+        else:
+            self.win.blits([(c.scaled_overlay, add(self.offset, mul(c.rect.topleft, self.scale))) for c in chunks if c.scaled_overlay is not None], doreturn=False)
         if self.game_is_over:
             msg = self.big_font.render(f"You got caught! Game Over!", 1, (255,0,0))
             msg_pos = sub(mul(self.win.get_size(), 1/2), mul(msg.get_size(), 1/2))
@@ -676,7 +1126,80 @@ class Game:
         else:
             self.next_button = None
 
+    def reload_map(self, files):
+        """ Swaps edits to the current map into the running game, redrawing and
+        recomputing only what the changed tiles touch """
+        if self.chunked is not None or is_infinite(self.map_name):
+            offset = self.offset
+            self.load_map(self.map_name)
+            self.offset = offset
+            self.restart_level()
+            return
+        new_map = load_tmx(self.map_name)
+        same_shape = (new_map.width, new_map.height, new_map.tilewidth, new_map.tileheight) == (self.w, self.h, self.tw, self.th)
+        if not same_shape or any(f != self.map_name for f in files):
+            # A tileset edit can change any tile, so just start again
+            offset = self.offset
+            self.load_map(self.map_name)
+            self.offset = offset
+            self.restart_level()
+            return
+        new_tiles = read_tiles(new_map)
+        changed = diff_tiles(self.map, self.tiles, new_map, new_tiles)
+        old_points = object_signature(self.map, 'Points')
+        dirty = {}
+        for layer, positions in changed.items():
+            dirty[layer] = [self.tile_rect(x, y, self.tiles[layer][(x,y)]) for x,y in positions if (x,y) in self.tiles.get(layer, {})]
+        self.map = new_map
+        self.atlas = TileAtlas(new_map)
+        self.tiles = new_tiles
+        for layer, positions in changed.items():
+            dirty[layer].extend(self.tile_rect(x, y, self.tiles[layer][(x,y)]) for x,y in positions if (x,y) in self.tiles.get(layer, {}))
+
+        for surface, layers in [(self.map_surface, floor_layers), (self.overlay_surface, overlay_layers)]:
+            rects = [r for layer in layers for r in dirty.get(layer, [])]
+            if len(rects) > 64:
+                rects = [rects[0].unionall(rects)]
+            for rect in rects:
+                self.redraw_region(surface, layers, rect)
+        depths = {x+y+1 for layer in wall_layers for x,y in changed.get(layer, [])}
+        for depth in depths:
+            self.draw_map_part(depth)
+
+        all_changed = sorted(set().union(*changed.values()), key=lambda p: (p[1],p[0]))
+        restart = False
+        if self.update_graph(all_changed):
+            # Patched in place, the graph's order can differ from a fresh
+            # load's, which changes how ties between paths are broken
+            self.build_graph()
+            restart = True
+        if object_signature(self.map, 'Points') != old_points:
+            self.load_points()
+            restart = True
+        if restart:
+            self.cursor = None
+            self.selection = None
+            self.selected_char = None
+            self.path_plan = None
+            self.restart_level()
+        else:
+            self.scale_map()
+            for depth in depths:
+                self.scale_map_part(depth)
+
     def apply_scale(self):
+        self.draw_list = DrawList()
+        self.drawn_chars = 0
+        if self.chunked is not None:
+            for chunk in self.loaded_chunks.values():
+                self.scale_chunk(chunk)
+            return
+        self.scale_map()
+        self.scaled_map_parts = {}
+        for depth in self.map_parts:
+            self.scale_map_part(depth)
+
+    def scale_map(self):
         ssize = mul(self.map_surface.get_size(), self.scale)
         self.scaled_map = pygame.transform.scale(self.map_surface, ssize)
         self.scaled_overlay = pygame.transform.scale(self.overlay_surface, ssize)
@@ -684,13 +1207,38 @@ class Game:
         self.scaled_overlay.convert_alpha()
         self.scaled_map.set_alpha(255)
         self.scaled_overlay.set_alpha(255)
-        self.scaled_map_parts = {}
-        for depth in self.map_parts:
-            part = self.map_parts[depth]
-            ssize = mul(part.get_size(), self.scale)
-            self.scaled_map_parts[depth] = pygame.transform.scale(part, ssize)
-            self.scaled_map_parts[depth].convert_alpha()
-            self.scaled_map_parts[depth].set_colorkey((0, 0, 0))
+
+    def scale_map_part(self, depth):
+        part = self.map_parts.get(depth)
+        if part is None:
+            self.scaled_map_parts.pop(depth, None)
+            self.draw_list.remove(('part', depth))
+            return
+        ssize = mul(part.get_size(), self.scale)
+        self.scaled_map_parts[depth] = pygame.transform.scale(part, ssize)
+        self.scaled_map_parts[depth].convert_alpha()
+        self.scaled_map_parts[depth].set_colorkey((0, 0, 0))
+        self.draw_list.set(('part', depth), (depth, 0), self.scaled_map_parts[depth], (0, self.strip_top(depth)))
+
+    def strip_top(self, depth):
+        """ Where the strip of wall tiles at depth goes, relative to the scaled map """
+        return math.ceil(self.scale * (-self.th+(depth-1) * (self.th/2)))
+
+    def update_char_sprites(self):
+        """ Brings the characters' entries in the draw list up to date, they
+        only move within it when a character steps onto a new depth """
+        for i, c in enumerate(self.all_chars):
+            cx, cy = c.pos
+            sprites = c.sprites(self.map_coords(c.pos, c.size), self.scale)
+            for j in range(2):
+                if j < len(sprites):
+                    self.draw_list.set(('char', i, j), (cx+cy, 1, i, j), *sprites[j])
+                else:
+                    self.draw_list.remove(('char', i, j))
+        for i in range(len(self.all_chars), self.drawn_chars):
+            for j in range(2):
+                self.draw_list.remove(('char', i, j))
+        self.drawn_chars = len(self.all_chars)
 
     def to_cursor_pos(self, pos):
         mouse_pos = mul(sub(pos, self.offset), 1/self.scale)
@@ -706,6 +1254,39 @@ class Game:
                 c.clear_selection()
         return selected
 
+    def update_hover(self):
+        """ Moves the cursor and path preview to wherever the mouse has got to,
+        skipping the work if it's still over the same tile as last time """
+        if not self.hover_pending:
+            return
+        self.hover_pending = False
+        mouse_pos = self.to_cursor_pos(self.last_mouse_pos)
+        key = (mouse_pos, self.selection, [c.destination for c in self.all_player_chars])
+        if key == self.hover_key:
+            return
+        self.hover_key = key
+        props = self.tile_props(floor_layers[0], mouse_pos)
+        if props.get('floor',False):
+            if not self.selection or self.space_is_free(mouse_pos):
+                self.cursor = mouse_pos
+                self.hover_occupied = None
+                if self.selection:
+                    # Not every floor tile can be reached from every other
+                    try:
+                        self.path_plan = self.find_path(self.selection, self.cursor)
+                    except (nx.NetworkXNoPath, nx.NodeNotFound):
+                        self.path_plan = None
+                else:
+                    self.path_plan = None
+            else:
+                self.hover_occupied = mouse_pos
+                self.path_plan = None
+                self.cursor = None
+        else:
+            self.cursor = None
+            self.path_plan = None
+            self.hover_occupied = None
+
     def space_is_free(self, pos):
         return not any(c.destination== pos for c in self.all_player_chars)
             
@@ -713,31 +1294,14 @@ class Game:
         match ev.type:
             case pygame.MOUSEMOTION:
                 self.last_mouse_pos = ev.pos
-                mouse_pos = self.to_cursor_pos(ev.pos)
-                props = None
-                try:
-                    props = self.map.get_tile_properties(*mouse_pos,0)
-                except Exception:
-                    pass
-                if props and props.get('floor',False):
-                    if not self.selection or self.space_is_free(mouse_pos):
-                        self.cursor = mouse_pos
-                        self.hover_occupied = None
-                        if self.selection:
-                            self.path_plan = nx.shortest_path(self.room, self.selection, self.cursor)
-                        else:
-                            self.path_plan = None
-                    else:
-                        self.hover_occupied = mouse_pos
-                        self.path_plan = None
-                        self.cursor = None
-                else:
-                    self.cursor = None
-                    self.path_plan = None
-                    self.hover_occupied = None
+                # Many of these can arrive in one frame, so what's under the
+                # mouse is only worked out once per frame, in update_hover
+                self.hover_pending = True
                 if self.panning:
                     self.offset = add(self.pan_start_offset, sub(ev.pos, self.pan_start_mouse))
             case pygame.MOUSEBUTTONDOWN:
+                # Clicks act on the cursor, so it has to be up to date
+                self.update_hover()
                 if ev.button == 1:
                     if self.winning_condition() and self.next_button is not None:
                         if self.next_button.collidepoint(self.last_mouse_pos):
@@ -773,6 +1337,9 @@ class Game:
                 self.scale = self.scroll/10
                 self.offset = sub(self.last_mouse_pos, mul(mul(sub(self.last_mouse_pos, self.offset), 1/old_scale), self.scale))
                 self.apply_scale()
+            case _MAP_CHANGED if _MAP_CHANGED == MAP_CHANGED:
+                if ev.map == self.map_name:
+                    self.reload_map(ev.files)
             case _:
                 print(f"Unknown event: {ev}")
 
@@ -791,9 +1358,56 @@ class Game:
             pygame.fastevent.post(pygame.event.Event(RENDER, {}))
             time.sleep(1/target_fps)
 
+    def watch_map(self):
+        self.loaded.wait()
+        watcher = None
+        while not self.stop_event.is_set():
+            if watcher is None or watcher.name != self.map_name:
+                watcher = MapWatcher(self.map_name)
+            changed = watcher.changed()
+            if changed:
+                pygame.fastevent.post(pygame.event.Event(MAP_CHANGED, {'map': watcher.name, 'files': changed}))
+            time.sleep(0.5)
+
+    def render_loading(self):
+        self.win.fill((0,0,0))
+        dots = '.' * (1 + int(time.time()*3) % 3)
+        text = self.button_font.render(f"Loading{dots}", 1, (255,255,255))
+        w, h = self.win.get_size()
+        self.win.blit(text, ((w-text.get_width())//2, (h-text.get_height())//2))
+
+    def wait_for_level(self):
+        """ Keeps the window drawn while the first level loads in the
+        background, returns False if the game should exit instead """
+        first = True
+        while not self.loaded.is_set():
+            ev = pygame.fastevent.wait()
+            if ev.type == pygame.QUIT:
+                return False
+            if ev.type == pygame.MOUSEMOTION:
+                # Zooming goes towards wherever the mouse was left
+                self.last_mouse_pos = ev.pos
+            if ev.type == RENDER:
+                self.render_loading()
+                pygame.display.flip()
+                if first:
+                    timings.add('loading frame', timings.start)
+                    first = False
+                self.can_render.set()
+        if self.load_error is not None:
+            traceback.print_exception(self.load_error, file=sys.stderr)
+            return False
+        self.last_time = time.time()
+        return True
+
     def run(self):
         threading.Thread(target=self.render_poll).start()
+        threading.Thread(target=self.watch_map, daemon=True).start()
         try:
+            if not self.wait_for_level():
+                self.quit()
+                return
+            first_frame = True
             while ev := pygame.fastevent.wait():
                 match ev.type:
                     case pygame.QUIT:
@@ -803,12 +1417,18 @@ class Game:
                         diff = now - self.last_time
                         self.last_time = now
                         try:
+                            self.update_hover()
                             self.update(diff)
                             self.render()
                         except Exception as e:
                             traceback.print_exception(e, file=sys.stderr)
                         self.fps_counter(diff)
                         pygame.display.flip()
+                        if first_frame:
+                            timings.add('first frame', timings.start)
+                            first_frame = False
+                            if self.show_timings:
+                                timings.report()
                         self.can_render.set()
                     case _:
                         try:
@@ -820,9 +1440,10 @@ class Game:
         self.quit()
 
 def main():
-    pygame.init()
-    pygame.fastevent.init()
-    game = Game()
+    with timings.phase('pygame init'):
+        pygame.init()
+        pygame.fastevent.init()
+    game = Game(background_load=True, show_timings='--timings' in sys.argv)
     game.run()
 
 if __name__=="__main__":
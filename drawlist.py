@@ -0,0 +1,47 @@
+import bisect
+
+class DrawList:
+    """ Map strips and sprites kept in depth order between frames
+
+    Each entry has a name, a sort key and a position relative to the map's
+    offset on screen. Entries are only moved when their sort key changes, and
+    their screen positions are only all worked out again when the map has been
+    panned, so a frame where nothing moved costs one Surface.blits call. """
+    def __init__(self):
+        self.keys = {}
+        self.order = []
+        self.rel = []
+        self.seq = []
+        self.offset = (0,0)
+
+    def screen_pos(self, rel):
+        return (self.offset[0]+rel[0], self.offset[1]+rel[1])
+
+    def set(self, name, sort_key, surface, rel):
+        key = (sort_key, name)
+        if self.keys.get(name) != key:
+            self.remove(name)
+            i = bisect.bisect_left(self.order, key)
+            self.order.insert(i, key)
+            self.rel.insert(i, rel)
+            self.seq.insert(i, (surface, self.screen_pos(rel)))
+            self.keys[name] = key
+        else:
+            i = bisect.bisect_left(self.order, key)
+            self.rel[i] = rel
+            self.seq[i] = (surface, self.screen_pos(rel))
+
+    def remove(self, name):
+        key = self.keys.pop(name, None)
+        if key is None:
+            return
+        i = bisect.bisect_left(self.order, key)
+        del self.order[i]
+        del self.rel[i]
+        del self.seq[i]
+
+    def draw(self, surf, offset):
+        if offset != self.offset:
+            self.offset = offset
+            self.seq = [(s, self.screen_pos(r)) for (s, _), r in zip(self.seq, self.rel)]
+        surf.blits(self.seq, doreturn=False)
@@ -0,0 +1,79 @@
+import os
+import xml.etree.ElementTree as ET
+
+def map_files(name):
+    """ The map file plus every tileset and image it pulls in """
+    files = [name]
+    base = os.path.dirname(name)
+    root = ET.parse(name).getroot()
+    for tileset in root.iter('tileset'):
+        source = tileset.get('source')
+        if source is not None:
+            tsx = os.path.join(base, source)
+            files.append(tsx)
+            tileset = ET.parse(tsx).getroot()
+            tileset_base = os.path.dirname(tsx)
+        else:
+            tileset_base = base
+        for image in tileset.iter('image'):
+            files.append(os.path.join(tileset_base, image.get('source')))
+    return files
+
+def mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+class MapWatcher:
+    """ Notices when a map, or one of the tilesets it uses, changes on disk """
+    def __init__(self, name):
+        self.name = name
+        self.mtimes = {}
+        self.refresh()
+
+    def refresh(self):
+        try:
+            files = map_files(self.name)
+        except (OSError, ET.ParseError):
+            # Probably caught mid-save, try again next time
+            files = list(self.mtimes) or [self.name]
+        self.mtimes = {f: mtime(f) for f in files}
+
+    def changed(self):
+        """ Files that have changed since the last call """
+        changed = [f for f, t in self.mtimes.items() if mtime(f) != t]
+        if changed:
+            self.refresh()
+        return changed
+
+def tile_keys(tmx):
+    """ pytmx renumbers gids as it loads a map, this maps them back to the
+    (gid, flags) used in the file so that two loads can be compared """
+    keys = {}
+    for key, value in tmx.imagemap.items():
+        if isinstance(value, tuple):
+            keys[value[0]] = key
+    return keys
+
+def diff_tiles(old_tmx, old_tiles, new_tmx, new_tiles):
+    """ Positions that differ between two reads of the same map, by layer """
+    old_keys = tile_keys(old_tmx)
+    new_keys = tile_keys(new_tmx)
+    changed = {}
+    for layer in set(old_tiles) | set(new_tiles):
+        old = old_tiles.get(layer, {})
+        new = new_tiles.get(layer, {})
+        changed[layer] = {
+            p for p in set(old) | set(new)
+            if old_keys.get(old.get(p)) != new_keys.get(new.get(p))
+        }
+    return changed
+
+def object_signature(tmx, name):
+    """ Everything about an object layer that the game reads """
+    try:
+        layer = tmx.get_layer_by_name(name)
+    except ValueError:
+        return None
+    return [(o.x, o.y, o.width, o.height, sorted(o.properties.items())) for o in layer]
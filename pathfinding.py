@@ -0,0 +1,128 @@
+from startup import lazy_import
+nx = lazy_import('networkx')
+
+class RoomPaths:
+    """ Hierarchical shortest paths over a floor graph
+
+    The floor is split into rooms by cutting it at its doors. The paths between
+    every pair of door tiles in the same room are found once up front, which
+    leaves a small abstract graph of door tiles to search at query time. Only
+    the rooms holding the two ends of a query are searched tile by tile, every
+    other room on the route is filled in from the cached paths. When the floor
+    graph changes, update redoes only the rooms around the changed tiles. """
+    def __init__(self, graph, doors):
+        self.graph = graph
+        self.door_edges = set()
+        self.inner = nx.Graph()
+        self.room_of = {}
+        self.room_tiles = {}
+        self.next_room = 0
+        self.abstract = nx.Graph()
+        self.cached = {}
+        self.update(doors, graph.nodes)
+
+    def update(self, doors, changed):
+        """ Catches up with edits to the floor graph, which may only have added,
+        removed or reconnected the tiles at the changed positions """
+        g = self.graph
+        door_edges = {(f,t) for f,t in doors if g.has_edge(f,t)}
+        old_door_edges = self.door_edges
+        self.door_edges = door_edges
+
+        # Tiles whose room might be different now
+        touched = set()
+        for p in changed:
+            touched.add(p)
+            if p in self.inner:
+                touched.update(self.inner[p])
+                self.inner.remove_node(p)
+            if p in g:
+                self.inner.add_node(p)
+                for q in g[p]:
+                    touched.add(q)
+                    if (p,q) not in door_edges and (q,p) not in door_edges:
+                        self.inner.add_edge(p, q)
+        for f,t in door_edges ^ old_door_edges:
+            touched.update([f, t])
+            if (f,t) in door_edges or (t,f) in door_edges:
+                if self.inner.has_edge(f, t):
+                    self.inner.remove_edge(f, t)
+            elif g.has_edge(f, t):
+                self.inner.add_edge(f, t)
+
+        # Throw away every room holding a touched tile
+        tiles = set()
+        for p in touched:
+            room = self.room_of.get(p)
+            if room in self.room_tiles:
+                tiles |= self.room_tiles.pop(room)
+        for p in tiles:
+            del self.room_of[p]
+            if p in self.abstract:
+                self.abstract.remove_node(p)
+        for k in [k for k in self.cached if k[0] in tiles]:
+            del self.cached[k]
+
+        # And find them again
+        tiles.update(p for p in touched if p in self.inner)
+        door_tiles = {f for f,t in door_edges}
+        for p in tiles:
+            if p in self.room_of or p not in self.inner:
+                continue
+            room = self.next_room
+            self.next_room += 1
+            found = nx.node_connected_component(self.inner, p)
+            self.room_tiles[room] = found
+            for tile in found:
+                self.room_of[tile] = room
+            exits = found & door_tiles
+            for a in exits:
+                paths = nx.single_source_shortest_path(self.inner, a)
+                for b in exits:
+                    if b != a:
+                        self.cached[(a,b)] = paths[b]
+                        self.abstract.add_edge(a, b, weight=len(paths[b])-1)
+        for f,t in door_edges:
+            if f in tiles or t in tiles:
+                self.abstract.add_edge(f, t, weight=1)
+
+    def room_exits(self, pos):
+        """ Shortest paths from pos to everywhere in its own room """
+        if pos not in self.room_of:
+            raise nx.NodeNotFound(f"Node {pos} not in graph")
+        return nx.single_source_shortest_path(self.inner, pos)
+
+    def shortest_path(self, source, target):
+        """ A shortest path from source to target, the same length as
+        nx.shortest_path(graph, source, target) but not always the same tiles
+        when there is more than one """
+        from_source = self.room_exits(source)
+        to_target = self.room_exits(target)
+        start, end = 'start', 'end'
+        try:
+            for door, path in from_source.items():
+                if door in self.abstract:
+                    self.abstract.add_edge(start, door, weight=len(path)-1)
+            for door, path in to_target.items():
+                if door in self.abstract:
+                    self.abstract.add_edge(door, end, weight=len(path)-1)
+            if target in from_source:
+                self.abstract.add_edge(start, end, weight=len(from_source[target])-1)
+            if start not in self.abstract or end not in self.abstract:
+                raise nx.NetworkXNoPath(f"No path between {source} and {target}.")
+            route = nx.dijkstra_path(self.abstract, start, end)
+        finally:
+            for n in [start, end]:
+                if n in self.abstract:
+                    self.abstract.remove_node(n)
+        if len(route) == 2:
+            return from_source[target]
+        doors = route[1:-1]
+        path = list(from_source[doors[0]])
+        for a, b in zip(doors, doors[1:]):
+            if (a,b) in self.door_edges:
+                path.append(b)
+            else:
+                path.extend(self.cached[(a,b)][1:])
+        path.extend(reversed(to_target[doors[-1]][:-1]))
+        return path
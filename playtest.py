@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+""" Monte Carlo playtesting farm
+
+Plays every level in Game.levels many times over with randomized (or scripted)
+player agents, driving the game through its own event() and update() logic,
+spread across a pool of worker processes. Prints win rate, time to catch, the
+tiles players get caught on most and any exceptions the game raised. """
+import os
+import json
+import random
+import argparse
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+import networkx as nx
+import door_jam
+from door_jam import add, target_fps
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# One game per worker process, reused for every trial that worker runs
+_game = None
+_loaded_level = None
+
+def init_worker():
+    global _game
+    os.chdir(here)
+    pygame.init()
+    _game = door_jam.Game()
+
+def start_level(game, level):
+    global _loaded_level
+    if _loaded_level != level:
+        game.cur_level = level
+        game.load_next_level()
+        _loaded_level = level
+    game.game_is_over = False
+    game.cursor = None
+    game.selection = None
+    game.selected_char = None
+    game.path_plan = None
+    game.hover_occupied = None
+    game.restart_level()
+
+def tile_centre(game, pos):
+    return add(game.coords(pos), (0, game.th/2*game.scale))
+
+def send_click(game, screen_pos):
+    game.event(pygame.event.Event(pygame.MOUSEMOTION, {'pos': screen_pos, 'rel': (0,0), 'buttons': (0,0,0)}))
+    game.event(pygame.event.Event(pygame.MOUSEBUTTONDOWN, {'pos': screen_pos, 'button': 1}))
+    game.event(pygame.event.Event(pygame.MOUSEBUTTONUP, {'pos': screen_pos, 'button': 1}))
+
+def command(game, char, target):
+    """ Click on a character then on its target, exactly as a player would """
+    send_click(game, tile_centre(game, char.pos))
+    send_click(game, tile_centre(game, target))
+
+class RandomAgent:
+    """ Every so often sends an idle player character to a random reachable tile """
+    def __init__(self, rng, think_every=15):
+        self.rng = rng
+        self.think_every = think_every
+
+    def act(self, game, tick):
+        if tick % self.think_every != 0:
+            return
+        idle = [c for c in game.all_player_chars if not c.walking]
+        if not idle:
+            return
+        char = self.rng.choice(idle)
+        if char.pos not in game.room:
+            return
+        reachable = sorted(nx.node_connected_component(game.room, char.pos))
+        command(game, char, self.rng.choice(reachable))
+
+class ScriptedAgent:
+    """ Replays a list of [tick, character index, [x, y]] moves """
+    def __init__(self, moves):
+        self.moves = {}
+        for tick, i, target in moves:
+            self.moves.setdefault(tick, []).append((i, tuple(target)))
+
+    def act(self, game, tick):
+        for i, target in self.moves.get(tick, []):
+            command(game, game.all_player_chars[i], target)
+
+def play(game, agent, max_ticks):
+    for tick in range(max_ticks):
+        agent.act(game, tick)
+        game.update(1)
+        if game.game_is_over:
+            seen = set(game.guard_vision)
+            caught_on = [c.pos for c in game.all_player_chars if c.pos in seen]
+            return 'caught', tick, caught_on
+        if game.winning_condition():
+            return 'won', tick, []
+    return 'timeout', max_ticks, []
+
+def new_results():
+    return {
+        'trials': 0
+        ,'won': 0
+        ,'caught': 0
+        ,'timeout': 0
+        ,'error': 0
+        ,'win_ticks': []
+        ,'catch_ticks': []
+        ,'caught_tiles': Counter()
+        ,'exceptions': Counter()
+        ,'tracebacks': {}
+    }
+
+def merge_results(into, other):
+    for k in ['trials', 'won', 'caught', 'timeout', 'error']:
+        into[k] += other[k]
+    into['win_ticks'].extend(other['win_ticks'])
+    into['catch_ticks'].extend(other['catch_ticks'])
+    into['caught_tiles'].update(other['caught_tiles'])
+    into['exceptions'].update(other['exceptions'])
+    for k, v in other['tracebacks'].items():
+        into['tracebacks'].setdefault(k, v)
+
+def run_batch(level, first, count, seed, max_ticks, script):
+    """ Worker entry point, plays `count` trials of one level """
+    results = new_results()
+    for i in range(first, first+count):
+        results['trials'] += 1
+        try:
+            start_level(_game, level)
+            if script is not None:
+                agent = ScriptedAgent(script)
+            else:
+                agent = RandomAgent(random.Random(f'{seed}:{level}:{i}'))
+            outcome, tick, caught_on = play(_game, agent, max_ticks)
+        except Exception as e:
+            key = ''.join(traceback.format_exception_only(e)).strip()
+            results['error'] += 1
+            results['exceptions'][key] += 1
+            results['tracebacks'].setdefault(key, ''.join(traceback.format_exception(e)))
+            continue
+        results[outcome] += 1
+        if outcome == 'won':
+            results['win_ticks'].append(tick)
+        if outcome == 'caught':
+            results['catch_ticks'].append(tick)
+            results['caught_tiles'].update(caught_on)
+    return level, results
+
+def seconds(ticks):
+    # The game logic advances once per rendered frame
+    return ticks / target_fps
+
+def report(levels, all_results, show_tracebacks):
+    for level, name in enumerate(levels):
+        r = all_results.get(level)
+        if r is None:
+            continue
+        n = max(r['trials'], 1)
+        print(f"{name}: {r['trials']} trials")
+        print(f"  won {r['won']} ({100*r['won']/n:.1f}%), caught {r['caught']} ({100*r['caught']/n:.1f}%), timed out {r['timeout']}, errors {r['error']}")
+        for label, ticks in [('win', r['win_ticks']), ('catch', r['catch_ticks'])]:
+            if ticks:
+                ticks = sorted(ticks)
+                mean = sum(ticks)/len(ticks)
+                median = ticks[len(ticks)//2]
+                print(f"  time to {label}: mean {seconds(mean):.1f}s, median {seconds(median):.1f}s")
+        if r['caught_tiles']:
+            hot = ', '.join(f'{pos} x{n}' for pos, n in r['caught_tiles'].most_common(5))
+            print(f"  most caught on: {hot}")
+        for key, count in r['exceptions'].most_common():
+            print(f"  exception x{count}: {key}")
+            if show_tracebacks:
+                print(r['tracebacks'][key])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--trials', type=int, default=1000, help='trials per level')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--batch', type=int, default=None, help='trials per worker task')
+    parser.add_argument('--max-ticks', type=int, default=6000, help='give up on a trial after this many game frames')
+    parser.add_argument('--seed', default='0', help='random seed')
+    parser.add_argument('--level', type=int, action='append', help='only play this level index (repeatable)')
+    parser.add_argument('--script', help='JSON file mapping level file names to lists of [tick, character, [x, y]] moves')
+    parser.add_argument('--tracebacks', action='store_true', help='print a full traceback for each distinct exception')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    os.chdir(here)
+    levels = door_jam.levels
+    scripts = {}
+    if args.script:
+        with open(args.script) as f:
+            scripts = json.load(f)
+    to_play = args.level if args.level else range(len(levels))
+    if scripts:
+        to_play = [l for l in to_play if levels[l] in scripts]
+
+    workers = max(1, args.workers)
+    batch = args.batch or max(1, -(-args.trials // (workers*4)))
+    all_results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        jobs = []
+        for level in to_play:
+            all_results[level] = new_results()
+            for first in range(0, args.trials, batch):
+                count = min(batch, args.trials - first)
+                jobs.append(pool.submit(run_batch, level, first, count, args.seed, args.max_ticks, scripts.get(levels[level])))
+        for job in as_completed(jobs):
+            level, results = job.result()
+            merge_results(all_results[level], results)
+
+    report(levels, all_results, args.tracebacks)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                levels[level]: {
+                    **r
+                    ,'caught_tiles': [[list(pos), n] for pos, n in r['caught_tiles'].most_common()]
+                    ,'exceptions': dict(r['exceptions'])
+                } for level, r in all_results.items()
+            }, f, indent=1)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,78 @@
+import os
+import sys
+import json
+import time
+import importlib.util
+from contextlib import contextmanager
+
+class Timings:
+    """ Records how long each part of starting up takes """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = []
+
+    def add(self, name, began):
+        now = time.perf_counter()
+        self.phases.append((name, began - self.start, now - began))
+
+    @contextmanager
+    def phase(self, name):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, began)
+
+    def report(self, file=sys.stderr):
+        for name, at, took in self.phases:
+            print(f"{name:>16}: {took*1000:7.1f}ms (started at {at*1000:7.1f}ms)", file=file)
+
+def lazy_import(name):
+    """ Imports a module the first time one of its attributes is used, so that
+    big libraries don't hold up the window appearing """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'door_jam')
+
+_font_paths = None
+
+def font_paths():
+    global _font_paths
+    if _font_paths is None:
+        try:
+            with open(os.path.join(cache_dir(), 'fonts.json')) as f:
+                _font_paths = json.load(f)
+        except (OSError, ValueError):
+            _font_paths = {}
+    return _font_paths
+
+def save_font_paths():
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        with open(os.path.join(cache_dir(), 'fonts.json'), 'w') as f:
+            json.dump(font_paths(), f)
+    except OSError:
+        pass
+
+def sys_font(name, size):
+    """ Same as pygame.font.SysFont, but remembers which file it found between
+    runs, because looking through all of the system fonts is slow. A font that
+    wasn't found is remembered as '', delete the cache to look again """
+    import pygame
+    paths = font_paths()
+    path = paths.get(name)
+    if path is None or (path and not os.path.exists(path)):
+        path = pygame.font.match_font(name) or ''
+        paths[name] = path
+        save_font_paths()
+    return pygame.font.Font(path or None, size)